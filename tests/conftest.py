@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def inmemory(tmp_path_factory):
+    # The module loads its sample data and writes the SQLite mirror into
+    # the working directory on import, so keep that out of the checkout
+    pytest.importorskip("matplotlib")
+    pytest.importorskip("openpyxl")
+    os.chdir(tmp_path_factory.mktemp("inmemory"))
+    import inmemory
+    return inmemory
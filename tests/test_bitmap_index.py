@@ -0,0 +1,51 @@
+import pickle
+
+
+def _rows(n, prefix="r"):
+    return {f"{prefix}{i}": {"kind": i % 3, "flag": i % 2 == 0, "v": i} for i in range(n)}
+
+
+def test_bitmap_filter_matches_scan_with_interned_ids(inmemory):
+    inmemory.store_data("bm_t", _rows(500))
+    inmemory.create_index("bm_t", "kind", "bitmap")
+    inmemory.create_index("bm_t", "flag", "bitmap")
+    kind, flag = inmemory.index_store["bm_t_kind"], inmemory.index_store["bm_t_flag"]
+    assert kind.interner is flag.interner
+    data = inmemory.retrieve_data("bm_t")
+    for cond in [{"kind": 1, "flag": True}, {"kind": {"$in": [0, 2]}},
+                 {"$or": [{"kind": 0}, {"flag": False}]}, {"kind": 7}]:
+        bitmap = inmemory.bitmap_filter("bm_t", cond)
+        matches = inmemory.compile_mongo_filter(cond)
+        expected = {row_id for row_id, record in data.items() if matches(record)}
+        assert set(bitmap) == expected
+        assert len(bitmap) == len(expected)
+    inmemory.insert_record("bm_t", "new", {"kind": 1, "flag": True, "v": 0}, mirror_disk=False)
+    inmemory.delete_record("bm_t", "r4", mirror_disk=False)
+    bitmap = inmemory.bitmap_filter("bm_t", {"kind": 1, "flag": True})
+    assert "new" in bitmap and "r4" not in bitmap
+
+
+def test_interner_is_released_with_the_indexes(inmemory):
+    inmemory.store_data("bm_u", _rows(300, "a"))
+    inmemory.create_index("bm_u", "kind", "bitmap")
+    old = inmemory.index_store["bm_u_kind"].interner
+    for i in range(300):
+        inmemory.delete_record("bm_u", f"a{i}", mirror_disk=False)
+    inmemory.store_data("bm_u", _rows(10, "b"))
+    interner = inmemory.index_store["bm_u_kind"].interner
+    assert interner is not old
+    assert sorted(interner.row_ids) == sorted(f"b{i}" for i in range(10))
+    # Unseen ids are looked up without being interned
+    assert "zzz" not in inmemory.index_store["bm_u_kind"].get(0)
+    assert len(interner.row_ids) == 10
+    inmemory.drop_table("bm_u")
+    assert not any(meta["table"] == "bm_u" for meta in inmemory.index_meta.values())
+
+
+def test_pickled_indexes_keep_sharing_their_interner(inmemory):
+    inmemory.store_data("bm_p", _rows(100))
+    inmemory.create_index("bm_p", "kind", "bitmap")
+    inmemory.create_index("bm_p", "flag", "bitmap")
+    kind, flag = pickle.loads(pickle.dumps((inmemory.index_store["bm_p_kind"], inmemory.index_store["bm_p_flag"])))
+    assert kind.interner is flag.interner
+    assert set(kind.get(1) & flag.get(True)) == {f"r{i}" for i in range(100) if i % 3 == 1 and i % 2 == 0}
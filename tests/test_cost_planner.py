@@ -0,0 +1,88 @@
+import random
+import sqlite3
+
+import pytest
+
+# (query, the access path or join strategy the statistics should pick)
+PLANS = [
+    ("SELECT COUNT(*), SUM(amt) FROM cp_orders WHERE status = 'new'", "index cp_orders (cp_orders_status"),
+    ("SELECT COUNT(*), SUM(amt) FROM cp_orders WHERE status = 'done'", "scan cp_orders"),
+    ("SELECT id FROM cp_orders WHERE amt BETWEEN 10 AND 12", "index cp_orders (cp_orders_amt"),
+    ("SELECT COUNT(*) FROM cp_orders WHERE amt > 20", "scan cp_orders"),
+    ("SELECT COUNT(*) FROM cp_orders o JOIN cp_cust c ON o.cust = c.cid WHERE c.vip = 1", "order c, o"),
+    ("SELECT c.region, COUNT(*) FROM cp_orders o JOIN cp_cust c ON o.cust = c.cid WHERE c.vip = 1 GROUP BY c.region",
+     "index join o (cp_orders_cust)"),
+    ("SELECT o.id, p.label FROM cp_promo p JOIN cp_orders o ON o.cust = p.cid", "index join o (cp_orders_cust)"),
+]
+
+# join_stored: probe the big side's index from a tiny table, else hash the smaller side
+STORED_JOINS = [
+    ("cp_promo", "cp_orders", "cid", "cust", "index join (probe right"),
+    ("cp_cust", "cp_orders", "cid", "cust", "hash join (build: left)"),
+    ("cp_orders", "cp_cust", "cust", "cid", "hash join (build: right)"),
+]
+
+
+@pytest.fixture(scope="module")
+def planner(inmemory):
+    random.seed(22)
+    orders = {i: {"id": i, "status": "done" if i % 10 else random.choice(["new", "hold"]),
+               "cust": random.randint(1, 200), "amt": random.randint(1, 1000)} for i in range(1, 20001)}
+    cust = {i: {"cid": i, "region": random.choice("nsew"), "vip": int(i % 50 == 0)} for i in range(1, 201)}
+    promo = {i: {"cid": i, "label": f"p{i}"} for i in range(1, 6)}
+    inmemory.store_data("cp_orders", orders)
+    inmemory.store_data("cp_cust", cust)
+    inmemory.store_data("cp_promo", promo)
+    inmemory.create_index("cp_orders", "status", "manual")
+    inmemory.create_index("cp_orders", "cust", "manual")
+    inmemory.create_index("cp_orders", "amt", "ordered")
+    inmemory.create_index("cp_cust", "cid", "unique")
+    conn = sqlite3.connect(inmemory.DISK_DB_FILE)
+    yield inmemory, conn
+    conn.close()
+    for table in ("cp_orders", "cp_cust", "cp_promo"):
+        inmemory.drop_table(table)
+
+
+@pytest.mark.parametrize("query, expected", PLANS)
+def test_plan_choice_and_result(planner, query, expected):
+    inmemory, conn = planner
+    _, rows, plan = inmemory.execute_sql(query)
+    assert expected in plan
+    assert inmemory._sql_rows_match(rows, conn.execute(query).fetchall())
+
+
+def test_estimates_track_the_data(planner):
+    inmemory, conn = planner
+    total = conn.execute("SELECT COUNT(*) FROM cp_orders").fetchone()[0]
+    for op, value in [("<", 250), (">=", 900), ("range", (100, 300, True, False))]:
+        where = {"<": "amt < 250", ">=": "amt >= 900", "range": "amt >= 100 AND amt < 300"}[op]
+        actual = conn.execute(f"SELECT COUNT(*) FROM cp_orders WHERE {where}").fetchone()[0] / total
+        assert inmemory.estimate_selectivity("cp_orders", "amt", op, value) == pytest.approx(actual, abs=0.03)
+    assert inmemory.estimate_selectivity("cp_orders", "amt", "=", 5000) == 0.0
+    distinct = conn.execute("SELECT COUNT(DISTINCT cust) FROM cp_orders").fetchone()[0]
+    assert inmemory.estimate_distinct("cp_orders", "cust") == pytest.approx(distinct, rel=0.05)
+    matches = conn.execute("SELECT COUNT(*) FROM cp_orders o JOIN cp_cust c ON o.cust = c.cid").fetchone()[0]
+    assert inmemory.estimate_join_rows("cp_orders", "cust", "cp_cust", "cid") == pytest.approx(matches, rel=0.1)
+
+
+def test_join_stored_picks_cheapest_strategy(planner):
+    inmemory, conn = planner
+    for left, right, left_key, right_key, expected in STORED_JOINS:
+        rows, plan = inmemory.join_stored(left, right, left_key, right_key)
+        assert expected in plan
+        reference = conn.execute(f"SELECT COUNT(*) FROM {left} a JOIN {right} b ON a.{left_key} = b.{right_key}")
+        assert sum(1 for _ in rows) == reference.fetchone()[0]
+
+
+def test_stale_statistics_are_refreshed(planner):
+    inmemory, _ = planner
+    inmemory.store_data("cp_stale", {i: {"id": i, "k": i % 4} for i in range(1000)})
+    assert inmemory.estimate_distinct("cp_stale", "k") == 4
+    for i in range(1000, 1400):
+        inmemory.insert_record("cp_stale", i, {"id": i, "k": i}, mirror_disk=False)
+    # 400 writes exceed STATS_STALE_FRACTION of 1000 rows, so this re-analyzes
+    assert inmemory.table_statistics("cp_stale")["analyzed_rows"] == 1400
+    assert inmemory.estimate_distinct("cp_stale", "k") == pytest.approx(404, rel=0.05)
+    assert inmemory.stats_report("cp_stale")["rows"] == 1400
+    inmemory.drop_table("cp_stale")
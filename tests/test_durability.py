@@ -0,0 +1,212 @@
+import os
+import pickle
+import sqlite3
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from conftest import ROOT
+
+# Runs in a child process so the "crash" can skip close_durable_store
+WRITER = '''
+import os, pickle, sys
+import inmemory
+directory, more_writes = sys.argv[1], sys.argv[2] == "1"
+inmemory.open_durable_store(directory, "group")
+inmemory.store_data("big", {i: {"id": i, "city": "ABCDE"[i % 5], "v": i % 97} for i in range(2000)})
+inmemory.create_index("big", "id", "unique")
+inmemory.create_index("big", "city", "manual")
+inmemory.create_index("big", "v", "ordered")
+inmemory.checkpoint()
+if more_writes:
+    for i in range(100):
+        inmemory.insert_record("big", 10000 + i, {"id": 10000 + i, "city": "Z", "v": i}, mirror_disk=False)
+    inmemory.update_record("big", 5, {"city": "Q"}, mirror_disk=False)
+    inmemory.delete_record("big", 7, mirror_disk=False)
+with open(os.path.join(directory, "expected.pkl"), "wb") as f:
+    pickle.dump(STATE(), f)
+print(inmemory._wal.path)
+os._exit(0)
+'''
+
+RECOVER = '''
+import os, pickle, sys
+import inmemory
+directory = sys.argv[1]
+recovered = inmemory.open_durable_store(directory)
+with open(os.path.join(directory, "recovered.pkl"), "wb") as f:
+    pickle.dump((recovered, STATE(), inmemory.wal_stats["replayed"], inmemory.plan_find("big", {"city": "Q"})[1]), f)
+'''
+
+STATE = '''
+def STATE():
+    indexes = {key: vars(value) if hasattr(value, "__dict__") else value
+               for key, value in inmemory.index_store.items() if key.startswith("big_")}
+    return inmemory.retrieve_data("big"), indexes, inmemory.store_version()
+'''
+
+
+def _run(tmp_path, script, *args, env=None):
+    path = tmp_path / "script.py"
+    path.write_text(script.replace("import inmemory\n", "import inmemory\n" + STATE))
+    env = dict(os.environ, **(env or {}), PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run([sys.executable, str(path), *args], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+# Started with INMEMORY_DURABLE_DIR, so the log holds the sample data too
+SESSION_A = '''
+import os, sys
+import inmemory
+inmemory.update_record("students", 101, {"StudentName": "FROM_A"})
+inmemory.insert_record("students", 9001, {"StudentID": 9001, "StudentName": "A1"})
+inmemory.insert_record("students", 9002, {"StudentID": 9002, "StudentName": "A2"})
+if sys.argv[1] == "1":
+    inmemory.checkpoint()
+print("done")
+os._exit(0)
+'''
+
+# A session with writes and warm caches of its own turns durability on; it
+# makes as many writes as SESSION_A, so its block ids match the recovered ones
+SESSION_B = '''
+import os, pickle, sys
+import inmemory
+inmemory.update_record("students", 101, {"StudentName": "FROM_B"})
+inmemory.insert_record("students", 9500, {"StudentID": 9500, "StudentName": "B"})
+inmemory.insert_record("students", 9501, {"StudentID": 9501, "StudentName": "B"})
+inmemory.retrieve_data("students")
+inmemory.execute_sql("SELECT * FROM students")
+recovered = inmemory.open_durable_store(sys.argv[1])
+rows = inmemory.retrieve_data("students")
+sql = inmemory.execute_sql("SELECT StudentID, StudentName FROM students")[1]
+with open(os.path.join(sys.argv[1], "session_b.pkl"), "wb") as f:
+    pickle.dump((recovered, rows, sql), f)
+'''
+
+
+def _load(directory, name):
+    with open(os.path.join(directory, name), "rb") as f:
+        return pickle.load(f)
+
+
+def test_replays_log_after_checkpoint_and_torn_tail(inmemory, tmp_path):
+    directory = str(tmp_path / "store")
+    wal_path = _run(tmp_path, WRITER, directory, "1").splitlines()[-1]
+    intact = os.path.getsize(wal_path)
+    with open(wal_path, "ab") as f:
+        f.write(b"\x10\x00\x00\x00torn")
+    _run(tmp_path, RECOVER, directory)
+    expected = _load(directory, "expected.pkl")
+    recovered, state, replayed, plan = _load(directory, "recovered.pkl")
+    assert recovered
+    assert state == expected
+    assert replayed == 102
+    assert os.path.getsize(wal_path) == intact
+    assert "index" in plan
+
+
+def test_restores_indexes_from_snapshot(inmemory, tmp_path):
+    directory = str(tmp_path / "store")
+    _run(tmp_path, WRITER, directory, "0")
+    _run(tmp_path, RECOVER, directory)
+    expected = _load(directory, "expected.pkl")
+    recovered, state, replayed, _ = _load(directory, "recovered.pkl")
+    assert recovered
+    assert replayed == 0
+    assert state[1] == expected[1]
+    assert set(state[1]) == {"big_id", "big_city", "big_v"}
+    assert state == expected
+
+
+@pytest.mark.parametrize("checkpointed", [False, True])
+def test_recovery_replaces_state_of_running_session(inmemory, tmp_path, checkpointed):
+    directory = str(tmp_path / "store")
+    _run(tmp_path, SESSION_A, "1" if checkpointed else "0", env={"INMEMORY_DURABLE_DIR": directory})
+    _run(tmp_path, SESSION_B, directory)
+    recovered, rows, sql = _load(directory, "session_b.pkl")
+    assert recovered
+    assert rows[101]["StudentName"] == "FROM_A"
+    assert {9001, 9002} <= set(rows)
+    assert not {9500, 9501} & set(rows)
+    assert sorted(sql) == sorted((row_id, record["StudentName"]) for row_id, record in rows.items())
+
+
+def test_group_commit_returns_after_fsync(inmemory, tmp_path, monkeypatch):
+    inmemory.open_durable_store(str(tmp_path / "store"), "group")
+    try:
+        wal = inmemory._wal
+        wal.group_ms = 20
+        events = []
+        unsynced = []
+        versions = threading.local()
+        append, fsync = wal.append, inmemory.os.fsync
+
+        def record_append(version, records):
+            versions.last = version
+            append(version, records)
+
+        def record_fsync(fd):
+            fsync(fd)
+            if fd == wal.fd:
+                events.append(("fsync", wal.written))
+        monkeypatch.setattr(wal, "append", record_append)
+        monkeypatch.setattr(inmemory.os, "fsync", record_fsync)
+        inmemory.store_data("wal_group", {})
+
+        def writer(k):
+            for i in range(25):
+                row_id = k * 100 + i
+                inmemory.insert_record("wal_group", row_id, {"id": row_id}, mirror_disk=False)
+                events.append(("commit", versions.last))
+                if wal.synced < versions.last:
+                    unsynced.append(versions.last)
+        threads = [threading.Thread(target=writer, args=(k,)) for k in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert unsynced == []
+        synced = 0
+        commits = 0
+        for kind, version in events:
+            if kind == "fsync":
+                synced = max(synced, version)
+            else:
+                commits += 1
+                assert version <= synced
+        fsyncs = sum(kind == "fsync" for kind, version in events)
+        assert commits == 100
+        assert fsyncs < commits
+    finally:
+        inmemory.close_durable_store(final_checkpoint=False)
+
+
+def test_benchmark_tables_stay_out_of_log_and_store(inmemory, tmp_path):
+    directory = str(tmp_path / "store")
+    inmemory.open_durable_store(directory, "none")
+    try:
+        inmemory.store_data("kept", {1: {"a": 1}})
+        report = inmemory.run_benchmarks({"sizes": [300], "layouts": ["row"], "backends": ["memory", "disk"],
+                                          "workloads": ["scan", "sql"], "warmup": 0, "repeats": 2,
+                                          "point_gets": 10, "output": None}, progress=lambda line: None)
+        assert report["results"]
+        assert not {"bench_fact", "bench_dim"} & set(inmemory.memory_db)
+        assert not inmemory.unlogged_tables
+        conn = sqlite3.connect(inmemory.DISK_DB_FILE)
+        mirrored = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        conn.close()
+        assert not {"bench_fact", "bench_dim"} & mirrored
+        logged = {record[1] for path in inmemory._wal_files(directory)
+                  for _, records in inmemory._read_wal(path) for record in records}
+        assert logged == {"kept"}
+        inmemory.drop_table("kept")
+        assert "kept" not in inmemory.memory_db
+        last = list(inmemory._read_wal(inmemory._wal.path))[-1][1]
+        assert last == [("drop", "kept")]
+    finally:
+        inmemory.close_durable_store(final_checkpoint=False)
@@ -0,0 +1,78 @@
+import random
+import sqlite3
+
+import pytest
+
+AGGREGATIONS = {"n": ("count", None), "nv": ("count", "v"), "s": ("sum", "v"), "a": ("avg", "v"),
+                "lo": ("min", "name"), "hi": ("max", "v"), "d": ("approx_distinct", "name")}
+SELECT = "COUNT(*), COUNT(v), COALESCE(SUM(v), 0), AVG(v), MIN(name), MAX(v), COUNT(DISTINCT name)"
+
+# (keys, Mongo-style where, equivalent WHERE clause)
+GROUPINGS = [
+    (["g"], None, ""),
+    (["g", "h"], {"v": {"$gte": 10}}, "WHERE v >= 10"),
+    ([], {"h": "q"}, "WHERE h = 'q'"),
+    ([], {"v": {"$gt": 10 ** 6}}, "WHERE v > 1000000"),
+    (["h"], {"$or": [{"g": 1}, {"name": "n3"}]}, "WHERE g = 1 OR name = 'n3'"),
+]
+
+
+@pytest.fixture(scope="module")
+def grouped(inmemory):
+    random.seed(13)
+    rows = {i: {"id": i, "g": random.choice([1, 2, 3, None]), "h": random.choice("pq"),
+                "v": random.choice([None, random.randint(-50, 50), random.random() * 100]),
+                "name": random.choice([None] + [f"n{k}" for k in range(40)])} for i in range(1, 3001)}
+    inmemory.store_data("gb", rows)
+    conn = sqlite3.connect(inmemory.DISK_DB_FILE)
+    yield inmemory, conn
+    conn.close()
+    inmemory.drop_table("gb")
+
+
+def _check(rows, keys, reference):
+    got = {tuple(row[key] for key in keys): row for row in rows}
+    assert len(got) == len(reference)
+    for ref in reference:
+        row = got[tuple(ref[:len(keys)])]
+        n, nv, s, a, lo, hi, d = ref[len(keys):]
+        assert (row["n"], row["nv"], row["lo"], row["hi"]) == (n, nv, lo, hi)
+        assert row["s"] == pytest.approx(s)
+        assert row["a"] == (None if a is None else pytest.approx(a))
+        assert abs(row["d"] - d) <= max(1, d * 0.05)
+
+
+@pytest.mark.parametrize("layout", ["row", "columnar"])
+@pytest.mark.parametrize("keys, where, clause", GROUPINGS)
+def test_group_by_matches_sqlite(grouped, layout, keys, where, clause):
+    inmemory, conn = grouped
+    inmemory.set_table_layout("gb", layout)
+    rows, plan = inmemory.group_by("gb", keys, AGGREGATIONS, where)
+    assert "hash group" in plan
+    group = f" GROUP BY {', '.join(keys)}" if keys else ""
+    reference = conn.execute(f"SELECT {', '.join(keys + [SELECT])} FROM gb {clause}{group}").fetchall()
+    _check(rows, keys, reference)
+
+
+def test_pipeline_group_matches_disk(grouped):
+    inmemory, _ = grouped
+    pushed = [{"$match": {"h": "p"}},
+              {"$group": {"_id": {"g": "$g"}, "total": {"$sum": "$v"}, "rows": {"$sum": 1},
+                          "top": {"$max": "$name"}, "mean": {"$avg": "$v"}}},
+              {"$sort": {"rows": -1}}]
+    docs, plan = inmemory.mongo_aggregate("gb", pushed)
+    assert "hash group" in plan
+    disk = inmemory.mongo_aggregate_disk("gb", pushed)
+    key = lambda doc: (doc["_id"]["g"] is None, doc["_id"]["g"] or 0)
+    assert [(d["_id"], d["rows"], d["top"]) for d in sorted(docs, key=key)] == \
+           [(d["_id"], d["rows"], d["top"]) for d in sorted(disk, key=key)]
+    for doc, ref in zip(sorted(docs, key=key), sorted(disk, key=key)):
+        assert doc["total"] == pytest.approx(ref["total"])
+        assert doc["mean"] == pytest.approx(ref["mean"])
+    # A $group after other stages runs over the streamed documents instead
+    streamed, plan = inmemory.mongo_aggregate("gb", [{"$project": {"h": 1, "v": 1}},
+                                                     {"$group": {"_id": "$h", "c": {"$count": {}}, "s": {"$sum": "$v"}}}])
+    assert "$group" in plan
+    rows, _ = inmemory.group_by("gb", "h", {"c": ("count", None), "s": ("sum", "v")})
+    assert {d["_id"]: d["c"] for d in streamed} == {r["h"]: r["c"] for r in rows}
+    assert {d["_id"]: pytest.approx(d["s"]) for d in streamed} == {r["h"]: r["s"] for r in rows}
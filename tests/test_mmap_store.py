@@ -0,0 +1,79 @@
+import random
+import sqlite3
+
+import pytest
+
+# (lo, hi, include_lo, include_hi); ints sort before strs, as in SQLite
+RANGES = [
+    (None, None, True, True),
+    (-5, 40, True, True),
+    (-5, 40, False, False),
+    (10, "k", True, False),
+    ("b", None, False, True),
+    ("ka", "kz", True, True),
+    (2 ** 40, "a", True, True),
+    (100, 10, True, True),
+]
+
+
+@pytest.fixture
+def kv(inmemory, tmp_path):
+    random.seed(18)
+    keys = set(random.sample(range(-1000, 1000), 300))
+    keys |= {"".join(random.choice("abkz") for _ in range(random.randint(1, 6))) for _ in range(300)}
+    keys |= {2 ** 40, -(2 ** 63), "", "é"}
+    rows = {key: {"key": key, "v": random.random(), "tags": [random.randint(0, 9)] * 2} for key in keys}
+    table = inmemory.write_mmap_table(str(tmp_path / "kv.mdb"), rows)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE kv (k PRIMARY KEY, v)")
+    conn.executemany("INSERT INTO kv VALUES (?, ?)", [(key, row["v"]) for key, row in rows.items()])
+    yield table, rows, conn
+    conn.close()
+
+
+def _where(lo, hi, include_lo, include_hi):
+    parts, params = [], []
+    if lo is not None:
+        parts.append(f"k {'>=' if include_lo else '>'} ?")
+        params.append(lo)
+    if hi is not None:
+        parts.append(f"k {'<=' if include_hi else '<'} ?")
+        params.append(hi)
+    return " AND ".join(parts) or "1", params
+
+
+@pytest.mark.parametrize("lo, hi, include_lo, include_hi", RANGES)
+def test_range_matches_sqlite_order(kv, lo, hi, include_lo, include_hi):
+    table, rows, conn = kv
+    where, params = _where(lo, hi, include_lo, include_hi)
+    reference = conn.execute(f"SELECT k, v FROM kv WHERE {where} ORDER BY k", params).fetchall()
+    assert [(key, record["v"]) for key, record in table.range(lo, hi, include_lo, include_hi)] == reference
+
+
+def test_get_and_put(kv):
+    table, rows, _ = kv
+    assert len(table) == len(rows)
+    for key, record in rows.items():
+        assert table.get(key) == record
+    assert table.get(5000) is None and table.get("missing") is None
+    table.put_many({5000: {"key": 5000}, "z" * 20: {"key": "long"}, next(iter(rows)): {"key": "replaced"}})
+    assert len(table) == len(rows) + 2
+    assert table.get(5000) == {"key": 5000}
+    assert table.get("z" * 20) == {"key": "long"}
+    assert table.get(next(iter(rows))) == {"key": "replaced"}
+    assert list(table.range(4999, 5001)) == [(5000, {"key": 5000})]
+    with pytest.raises(ValueError):
+        table.get(1.5)
+
+
+def test_table_export_follows_writes(inmemory):
+    inmemory.store_data("mm_t", {i: {"id": i, "name": f"n{i}"} for i in range(50)})
+    first = inmemory.mmap_table("mm_t")
+    assert inmemory.mmap_table("mm_t") is first
+    assert dict(first.items()) == inmemory.retrieve_data("mm_t")
+    inmemory.update_record("mm_t", 7, {"name": "seven"}, mirror_disk=False)
+    table = inmemory.mmap_table("mm_t")
+    assert table is not first
+    assert table.get(7) == {"id": 7, "name": "seven"}
+    assert dict(table.items()) == inmemory.retrieve_data("mm_t")
+    inmemory.drop_table("mm_t")
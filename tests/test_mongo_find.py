@@ -0,0 +1,80 @@
+import random
+import sqlite3
+
+import pytest
+
+# (filter, equivalent WHERE clause, sort, skip, limit)
+FINDS = [
+    ({"city": "Oslo"}, "city = 'Oslo'", [], 0, None),
+    ({"age": {"$gt": 30, "$lte": 40}}, "age > 30 AND age <= 40", [("score", 1)], 0, None),
+    ({"city": {"$in": ["Rome", "Lima"]}, "age": {"$ne": 25}}, "city IN ('Rome', 'Lima') AND age <> 25",
+     [("score", -1)], 5, 10),
+    ({"$or": [{"city": "Oslo"}, {"age": {"$lt": 21}}]}, "city = 'Oslo' OR age < 21", [("id", 1)], 0, 7),
+    ({"$and": [{"age": {"$gte": 50}}, {"city": {"$nin": ["Oslo"]}}]}, "age >= 50 AND city NOT IN ('Oslo')",
+     [("age", 1), ("id", -1)], 3, None),
+    ({"$nor": [{"city": "Rome"}, {"age": {"$gt": 20}}]}, "NOT (city = 'Rome' OR age > 20)", [], 0, None),
+    ({"tag": {"$exists": True}, "age": {"$not": {"$gt": 60}}}, "tag IS NOT NULL AND NOT (age > 60)",
+     [("city", -1), ("score", 1)], 0, 20),
+    ({"tag": {"$exists": False}}, "tag IS NULL", [("score", 1)], 0, 3),
+    ({"score": {"$gte": 99.5}}, "score >= 99.5", [], 0, None),
+    ({"city": "Nowhere"}, "city = 'Nowhere'", [("age", 1)], 0, 5),
+]
+
+
+@pytest.fixture(scope="module")
+def mongo(inmemory):
+    random.seed(12)
+    docs = {}
+    for i in range(1, 1001):
+        doc = {"id": i, "city": random.choice(["Oslo", "Rome", "Lima", "Kyiv"]), "age": random.randint(18, 70),
+               "score": (i * 37) % 1000 / 10}
+        if i % 3:
+            doc["tag"] = random.choice(["a", "b"])
+        docs[i] = doc
+    inmemory.store_data("mg", docs)
+    inmemory.create_index("mg", "city", "manual")
+    inmemory.create_index("mg", "age", "ordered")
+    conn = sqlite3.connect(inmemory.DISK_DB_FILE)
+    yield inmemory, conn
+    conn.close()
+    inmemory.drop_table("mg")
+
+
+def _sql(where, sort, skip, limit):
+    # Ties are broken by id in SQL; the cases only leave ties under a second key
+    order = ", ".join(f"{field} {'ASC' if direction == 1 else 'DESC'}" for field, direction in sort)
+    query = f"SELECT id, city, age FROM mg WHERE {where} ORDER BY {order or 'id'}"
+    if limit is not None or skip:
+        query += f" LIMIT {limit if limit is not None else -1} OFFSET {skip}"
+    return query
+
+
+@pytest.mark.parametrize("cond, where, sort, skip, limit", FINDS)
+def test_find_matches_sqlite(mongo, cond, where, sort, skip, limit):
+    inmemory, conn = mongo
+    found, plan = inmemory.mongo_find("mg", cond, {"id": 1, "city": 1, "age": 1}, sort, skip, limit)
+    rows = [(doc["id"], doc["city"], doc["age"]) for doc in found.values()]
+    reference = conn.execute(_sql(where, sort, skip, limit)).fetchall()
+    if sort:
+        assert rows == reference, plan
+    else:
+        assert sorted(rows) == reference, plan
+    count, _ = inmemory.mongo_find("mg", cond, count=True)
+    assert count == conn.execute(f"SELECT COUNT(*) FROM mg WHERE {where}").fetchone()[0]
+
+
+def test_parsed_find_and_projection(mongo):
+    inmemory, conn = mongo
+    spec = inmemory.parse_mongo_find("db.mg.find({'city': 'Rome', 'age': {'$lt': 30}}, {'score': 0})"
+                                     ".sort({'age': -1, 'id': 1}).skip(2).limit(4)")
+    found, plan = inmemory.mongo_find("mg", spec["filter"], spec["projection"], spec["sort"], spec["skip"],
+                                      spec["limit"])
+    assert "mg_" in plan
+    assert all("score" not in doc for doc in found.values())
+    reference = conn.execute("SELECT id FROM mg WHERE city = 'Rome' AND age < 30 ORDER BY age DESC, id "
+                             "LIMIT 4 OFFSET 2").fetchall()
+    assert list(found) == [row_id for (row_id,) in reference]
+    with pytest.raises(ValueError, match="mix"):
+        inmemory.mongo_find("mg", {}, {"id": 1, "age": 0})
+    with pytest.raises(ValueError, match="Unsupported"):
+        inmemory.mongo_find("mg", {"age": {"$near": 3}})
@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def accounts(inmemory):
+    inmemory.store_data("mv_acct", {i: {"id": i, "owner": f"o{i % 5}", "balance": 100} for i in range(50)})
+    inmemory.store_data("mv_log", {0: {"id": 0, "note": "start"}})
+    inmemory.create_index("mv_acct", "owner", "manual")
+    yield inmemory
+    inmemory.drop_table("mv_acct")
+    inmemory.drop_table("mv_log")
+
+
+def test_reader_keeps_its_snapshot_while_writers_commit(accounts):
+    inmemory = accounts
+    with inmemory.read_snapshot() as snapshot:
+        before = inmemory.retrieve_data("mv_acct")
+
+        def write():
+            inmemory.update_record("mv_acct", 3, {"owner": "new"}, mirror_disk=False)
+            inmemory.delete_record("mv_acct", 4, mirror_disk=False)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer.join()
+        assert inmemory.store_version() == snapshot.version
+        assert inmemory.retrieve_data("mv_acct") == before
+        assert inmemory.table_row_count("mv_acct") == 50
+        assert sorted(inmemory.index_lookup("mv_acct", "owner")[0]("o3")) == [3, 8, 13, 18, 23, 28, 33, 38, 43, 48]
+        assert inmemory.execute_sql("SELECT COUNT(*) FROM mv_acct WHERE owner = 'new'")[1] == [(0,)]
+    assert inmemory.store_version() == snapshot.version + 2
+    assert inmemory.get_row("mv_acct", 3)["owner"] == "new"
+    assert inmemory.get_row("mv_acct", 4) is None
+    assert inmemory.execute_sql("SELECT id FROM mv_acct WHERE owner = 'new'")[1] == [(3,)]
+    assert 3 not in inmemory.index_lookup("mv_acct", "owner")[0]("o3")
+
+
+def test_failed_transaction_publishes_nothing(accounts):
+    inmemory = accounts
+    version = inmemory.store_version()
+    rollbacks = inmemory.mvcc_stats["rollbacks"]
+    with pytest.raises(ZeroDivisionError):
+        with inmemory.write_transaction("mv_acct"):
+            inmemory.update_record("mv_acct", 1, {"balance": 0, "owner": "gone"}, mirror_disk=False)
+            inmemory.insert_record("mv_acct", 99, {"id": 99, "owner": "o1", "balance": 1}, mirror_disk=False)
+            1 / 0
+    assert inmemory.store_version() == version
+    assert inmemory.mvcc_stats["rollbacks"] == rollbacks + 1
+    assert inmemory.get_row("mv_acct", 1) == {"id": 1, "owner": "o1", "balance": 100}
+    assert inmemory.get_row("mv_acct", 99) is None
+    assert 99 not in inmemory.index_lookup("mv_acct", "owner")[0]("o1")
+    with pytest.raises(RuntimeError):
+        inmemory.memory_db["mv_acct"] = {}
+    with pytest.raises(RuntimeError, match="does not hold their locks"):
+        with inmemory.write_transaction("mv_acct"):
+            inmemory.insert_record("mv_log", 1, {"id": 1, "note": "x"}, mirror_disk=False)
+
+
+def test_concurrent_writers_lose_no_updates(accounts):
+    inmemory = accounts
+    errors = []
+
+    def transfer(worker):
+        try:
+            for i in range(40):
+                source, target = (worker + i) % 50, (worker * 7 + i + 1) % 50
+                if source == target:
+                    continue
+                with inmemory.write_transaction("mv_acct"):
+                    balance = inmemory.get_row("mv_acct", source)["balance"]
+                    amount = balance % 7 + 1
+                    inmemory.update_record("mv_acct", source, {"balance": balance - amount}, mirror_disk=False)
+                    balance = inmemory.get_row("mv_acct", target)["balance"]
+                    inmemory.update_record("mv_acct", target, {"balance": balance + amount}, mirror_disk=False)
+                # Another table commits at the same time without undoing these
+                inmemory.insert_record("mv_log", (worker, i), {"id": None, "note": f"{worker}:{i}"}, mirror_disk=False)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=transfer, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    balances = [record["balance"] for record in inmemory.retrieve_data("mv_acct").values()]
+    assert sum(balances) == 50 * 100
+    assert inmemory.table_row_count("mv_log") == 1 + 4 * 40
+    stats = inmemory.concurrency_check("mv_acct", readers=2, rounds=10, batch=5)
+    assert stats["inconsistent"] == 0
+    assert stats["reads"] > 0
+    assert inmemory.table_row_count("mv_acct") == 50
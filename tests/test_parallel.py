@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+
+@pytest.fixture(scope="module", params=[1, 2])
+def parallel(request, inmemory):
+    rng = random.Random(11)
+    inmemory.store_data("pj_fact", {i: {"id": i, "k": rng.choice([1, 2, 3, 4, 5, 1.0, "x", None]),
+                                        "v": rng.randrange(100)} for i in range(3000)})
+    inmemory.store_data("pj_dim", {f"d{i}": {"k": k, "name": f"n{i}"}
+                                   for i, k in enumerate([1, 2, 2, "x", 9, None, True])})
+    previous = inmemory.PARALLEL_WORKERS
+    inmemory.configure_parallel(request.param)
+    try:
+        yield inmemory
+    finally:
+        inmemory.configure_parallel(previous)
+
+
+def _sorted(rows):
+    return sorted(((key, sorted(record.items(), key=repr)) for key, record in rows), key=repr)
+
+
+@pytest.mark.parametrize("join_type", ["inner", "left", "right", "full", "semi", "anti"])
+@pytest.mark.parametrize("swap", [False, True])
+def test_partitioned_hash_join_matches_join_tables(parallel, join_type, swap):
+    left, right = ("pj_dim", "pj_fact") if swap else ("pj_fact", "pj_dim")
+    rows, plan = parallel.parallel_hash_join(left, right, "k", "k", join_type)
+    expected = parallel.join_tables(parallel.retrieve_data(left), parallel.retrieve_data(right), "k", "k",
+                                    join_type)[0]
+    assert f"{parallel.PARALLEL_WORKERS} partitions" in plan
+    assert _sorted(rows) == _sorted(expected)
+
+
+def test_filter_and_group_by_match_serial(parallel):
+    cond = {"v": {"$gte": 50}, "k": {"$in": [1, 2]}}
+    assert parallel.parallel_filter("pj_fact", cond)[0] == parallel.mongo_find("pj_fact", cond)[0]
+    aggregations = {"n": ("count", None), "total": ("sum", "v"), "top": ("max", "v")}
+    serial = parallel.group_by("pj_fact", "k", aggregations)[0]
+    assert sorted(parallel.parallel_group_by("pj_fact", "k", aggregations)[0], key=repr) == sorted(serial, key=repr)
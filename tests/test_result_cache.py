@@ -0,0 +1,134 @@
+import random
+
+import pytest
+
+
+@pytest.fixture
+def cache(inmemory):
+    budget = inmemory.RESULT_CACHE_BUDGET_BYTES
+    inmemory.configure_result_cache(1024 * 1024)
+    inmemory.clear_result_cache()
+    inmemory.store_data("rc_items", {i: {"id": i, "kind": "ab"[i % 2], "price": i * 3} for i in range(200)})
+    try:
+        yield inmemory
+    finally:
+        inmemory.configure_result_cache(budget)
+        inmemory.clear_result_cache()
+
+
+def test_hit_returns_same_answer_as_a_copy(cache):
+    query = "SELECT id, price FROM rc_items WHERE kind = 'a'"
+    _, rows, plan = cache.execute_sql(query)
+    assert not plan.startswith("cached result")
+    _, again, plan = cache.execute_sql(query)
+    assert plan.startswith("cached result")
+    assert again == rows
+    again.clear()
+    assert cache.execute_sql(query)[1] == rows
+    found = cache.mongo_find("rc_items", {"kind": "b"})[0]
+    found[1]["price"] = -1
+    assert cache.mongo_find("rc_items", {"kind": "b"})[0][1]["price"] == 3
+
+
+def test_write_makes_cached_result_stale(cache):
+    query = "SELECT COUNT(*) FROM rc_items WHERE kind = 'b'"
+    assert cache.execute_sql(query)[1] == [(100,)]
+    cache.insert_record("rc_items", 500, {"id": 500, "kind": "b", "price": 1}, mirror_disk=False)
+    rows, plan = cache.execute_sql(query)[1:]
+    assert rows == [(101,)]
+    assert not plan.startswith("cached result")
+    # Filters that differ only in key order share an entry
+    cache.mongo_find("rc_items", {"kind": "a", "price": {"$lt": 30}})
+    assert cache.mongo_find("rc_items", {"price": {"$lt": 30}, "kind": "a"})[1].startswith("cached result")
+
+
+def test_eviction_keeps_within_budget(cache):
+    size = cache.result_cache_report()
+    cache.execute_sql("SELECT * FROM rc_items WHERE id < 5")
+    one = cache.result_cache_report()["bytes"] - size["bytes"]
+    cache.configure_result_cache(one * 3)
+    for i in range(10):
+        cache.execute_sql(f"SELECT * FROM rc_items WHERE id < 5 AND price >= {i}")
+    report = cache.result_cache_report()
+    assert report["bytes"] <= one * 3
+    assert report["evictions"] > 0
+    assert 0 < report["entries"] <= 3
+    cache.configure_result_cache(0)
+    assert cache.result_cache_report()["entries"] == 0
+    assert not cache.execute_sql("SELECT * FROM rc_items WHERE id < 5")[2].startswith("cached result")
+
+
+def _reference(inmemory):
+    s, t, d = (inmemory.retrieve_data(name) for name in ("mv_s", "mv_t", "mv_d"))
+    rows = {}
+    for sid, srow in s.items():
+        for tid, trow in t.items():
+            if srow.get("tid") is None or srow.get("tid") != trow.get("tid"):
+                continue
+            for did, drow in d.items():
+                if trow.get("did") is not None and trow.get("did") == drow.get("did") and srow["age"] >= 20:
+                    rows[f"{sid}-{tid}-{did}"] = {**srow, **trow, **drow}
+    return rows
+
+
+def test_view_follows_row_writes(inmemory):
+    rng = random.Random(3)
+    inmemory.store_data("mv_s", {i: {"sid": i, "tid": rng.choice([None] + list(range(10))),
+                                     "age": rng.randrange(18, 30)} for i in range(300)})
+    inmemory.store_data("mv_t", {i: {"tid": i, "did": rng.randrange(5)} for i in range(10)})
+    inmemory.store_data("mv_d", {i: {"did": i, "dname": f"d{i}"} for i in range(4)})
+    inmemory.create_view("mv", ["mv_s", "mv_t", "mv_d"], ["mv_s.tid = mv_t.tid", "mv_t.did = mv_d.did"],
+                         {"age": {"$gte": 20}})
+    try:
+        assert dict(inmemory.read_view("mv")) == _reference(inmemory)
+        held = inmemory.read_view("mv")
+        before = dict(held)
+        next_id = 1000
+        for step in range(300):
+            table = rng.choice(["mv_s", "mv_s", "mv_t", "mv_d"])
+            data = inmemory.retrieve_data(table)
+            action = rng.random()
+            if action < 0.4:
+                record = {"mv_s": {"sid": next_id, "tid": rng.randrange(10), "age": rng.randrange(18, 30)},
+                          "mv_t": {"tid": next_id % 12, "did": rng.randrange(5)},
+                          "mv_d": {"did": next_id % 6, "dname": "new"}}[table]
+                inmemory.insert_record(table, next_id, record, mirror_disk=False)
+                next_id += 1
+            elif action < 0.8 and data:
+                column = {"mv_s": "age", "mv_t": "did", "mv_d": "dname"}[table]
+                value = rng.randrange(18, 30) if table == "mv_s" else rng.randrange(5) if table == "mv_t" else "x"
+                inmemory.update_record(table, rng.choice(list(data)), {column: value}, mirror_disk=False)
+            elif data:
+                inmemory.delete_record(table, rng.choice(list(data)), mirror_disk=False)
+        assert dict(inmemory.read_view("mv")) == _reference(inmemory)
+        # A mapping already handed out stays as it was, and is read-only
+        assert dict(held) == before
+        with pytest.raises(TypeError):
+            held["x"] = {}
+        builds = inmemory.view_report()
+        inmemory.store_data("mv_d", {i: {"did": i, "dname": f"r{i}"} for i in range(5)})
+        assert dict(inmemory.read_view("mv")) == _reference(inmemory)
+        assert [r["builds"] for r in inmemory.view_report() if r["view"] == "mv"] == \
+            [r["builds"] + 1 for r in builds if r["view"] == "mv"]
+    finally:
+        inmemory.drop_view("mv")
+
+
+def test_view_projection_and_single_table(inmemory):
+    inmemory.store_data("mv_one", {i: {"id": i, "v": i % 7} for i in range(100)})
+    inmemory.create_view("mv_small", ["mv_one"], filter={"v": {"$lt": 2}}, projection={"id": 1})
+    try:
+        expected = {i: {"id": i} for i in range(100) if i % 7 < 2}
+        assert dict(inmemory.read_view("mv_small")) == expected
+        for i in range(100, 400):
+            inmemory.insert_record("mv_one", i, {"id": i, "v": i % 7}, mirror_disk=False)
+        inmemory.delete_record("mv_one", 0, mirror_disk=False)
+        expected = {i: {"id": i} for i in range(1, 400) if i % 7 < 2}
+        view = inmemory.read_view("mv_small")
+        assert dict(view) == expected
+        assert len(view) == len(expected)
+        assert 1 in view and 0 not in view
+    finally:
+        inmemory.drop_view("mv_small")
+    with pytest.raises(ValueError):
+        inmemory.read_view("mv_small")
@@ -0,0 +1,78 @@
+import random
+import sqlite3
+
+import pytest
+
+INDEXES = {"code": "unique", "dept": "manual", "age": "ordered", "kind": "bitmap"}
+
+
+@pytest.fixture
+def rows(inmemory):
+    random.seed(4)
+    data = {i: {"id": i, "code": f"c{i}", "dept": random.choice([1, 2, 3, None]), "age": random.randint(20, 40),
+                "kind": random.choice("xyz")} for i in range(1, 301)}
+    inmemory.store_data("rw_t", data)
+    for column, index_type in INDEXES.items():
+        inmemory.create_index("rw_t", column, index_type)
+    conn = sqlite3.connect(inmemory.DISK_DB_FILE)
+    yield inmemory, conn
+    conn.close()
+    inmemory.drop_table("rw_t")
+
+
+def _postings(index):
+    items = index.postings.items() if hasattr(index, "postings") else index.items()
+    return {key: sorted(ids) if hasattr(ids, "__iter__") and not isinstance(ids, str) else [ids]
+            for key, ids in items}
+
+
+def _check(inmemory, conn):
+    # Every index answers equality like SQLite does over the mirrored table,
+    # and matches an index rebuilt from scratch
+    data = inmemory.retrieve_data("rw_t")
+    reference = conn.execute("SELECT id, code, dept, age, kind FROM rw_t").fetchall()
+    assert sorted(tuple(record.values()) for record in data.values()) == sorted(reference)
+    for column, index_type in INDEXES.items():
+        lookup, name = inmemory.index_lookup("rw_t", column)
+        assert name == f"rw_t_{column}"
+        for (value,) in conn.execute(f"SELECT DISTINCT {column} FROM rw_t WHERE {column} IS NOT NULL"):
+            expected = conn.execute(f"SELECT id FROM rw_t WHERE {column} = ?", (value,)).fetchall()
+            assert sorted(lookup(value)) == sorted(row_id for (row_id,) in expected), (column, value)
+        fresh, _ = inmemory.build_index(data, column, index_type)
+        assert _postings(inmemory.index_store[name]) == _postings(fresh)
+        if index_type == "ordered":
+            assert inmemory.index_store[name].keys == fresh.keys
+
+
+def test_writes_keep_indexes_in_step(rows):
+    inmemory, conn = rows
+    next_id = 1000
+    for step in range(300):
+        live = list(inmemory.retrieve_data("rw_t"))
+        op = random.choice(["insert", "update", "update", "delete"])
+        if op == "insert":
+            next_id += 1
+            inmemory.insert_record("rw_t", next_id, {"id": next_id, "code": f"c{next_id}", "dept": random.choice([1, 4]),
+                                                     "age": random.randint(18, 45), "kind": random.choice("xw")})
+        elif op == "update":
+            changes = random.choice([{"age": random.randint(18, 45)}, {"dept": random.choice([2, None])},
+                                     {"kind": "w"}, {"code": f"u{step}"}])
+            inmemory.update_record("rw_t", random.choice(live), changes)
+        else:
+            inmemory.delete_record("rw_t", random.choice(live))
+        if step % 50 == 0:
+            _check(inmemory, conn)
+    _check(inmemory, conn)
+
+
+def test_rejected_write_changes_nothing(rows):
+    inmemory, conn = rows
+    version = inmemory.store_version()
+    with pytest.raises(ValueError, match="Duplicate key"):
+        inmemory.update_record("rw_t", 5, {"code": "c6", "age": 99})
+    with pytest.raises(ValueError, match="already exists"):
+        inmemory.insert_record("rw_t", 7, {"id": 7, "code": "new"})
+    assert inmemory.store_version() == version
+    assert inmemory.index_lookup("rw_t", "code")[0]("c6") == (6,)
+    assert 5 in inmemory.index_lookup("rw_t", "age")[0](inmemory.get_row("rw_t", 5)["age"])
+    _check(inmemory, conn)
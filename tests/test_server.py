@@ -0,0 +1,62 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def server(inmemory, monkeypatch):
+    inmemory.store_data("srv_items", {i: {"id": i, "qty": i * 2} for i in range(100)})
+    threads = []
+    handler, inline = inmemory.SERVER_OPS["mget"]
+
+    def recording(message):
+        threads.append((len(message["ids"]), threading.current_thread().name))
+        return handler(message)
+
+    monkeypatch.setitem(inmemory.SERVER_OPS, "mget", (recording, inline))
+    with socket.socket() as probe:
+        probe.bind((inmemory.SERVER_HOST, 0))
+        port = probe.getsockname()[1]
+    stop = inmemory.start_server_thread(port=port)
+    try:
+        yield inmemory, port, threads
+    finally:
+        stop()
+
+
+def test_mget_runs_on_loop_only_for_small_batches(server):
+    inmemory, port, threads = server
+    small, large = [3, 7, 500], list(range(inmemory.SERVER_INLINE_MGET + 1))
+
+    async def run():
+        client = await inmemory.StoreClient.connect(port=port)
+        try:
+            return await client.mget("srv_items", small), await client.mget("srv_items", large)
+        finally:
+            await client.close()
+
+    got_small, got_large = asyncio.run(run())
+    assert got_small == [{"id": 3, "qty": 6}, {"id": 7, "qty": 14}, None]
+    assert got_large == [inmemory.get_row("srv_items", i) for i in large]
+    # The executor's threads are named "store_N"; the event loop runs in another
+    ran_on = dict(threads)
+    assert not ran_on[len(small)].startswith("store")
+    assert ran_on[len(large)].startswith("store")
+
+
+def test_get_and_unknown_op(server):
+    inmemory, port, _ = server
+
+    async def run():
+        client = await inmemory.StoreClient.connect(port=port)
+        try:
+            record = await client.request("get", table="srv_items", row_id=42)
+            with pytest.raises(ValueError, match="Unknown op"):
+                await client.request("drop_everything")
+            return record
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) == {"id": 42, "qty": 84}
@@ -0,0 +1,99 @@
+import os
+import random
+import signal
+
+import pytest
+
+ORDERS = 600
+
+
+@pytest.fixture
+def shards(inmemory):
+    rng = random.Random(7)
+    inmemory.store_data("sh_orders", {i: {"oid": i, "cust": rng.choice([1, 2, 3, 4, 5, 6, 7, None]),
+                                          "amount": rng.randint(1, 500)} for i in range(ORDERS)})
+    inmemory.store_data("sh_customers", {c: {"cid": c, "tier": "gold" if c % 2 else "basic"} for c in range(1, 6)})
+    inmemory.start_shards(3)
+    try:
+        yield inmemory
+    finally:
+        inmemory.stop_shards()
+
+
+def _rows(rows):
+    return sorted((key, sorted(record.items(), key=repr)) for key, record in rows)
+
+
+def test_rows_are_routed_by_jump_hash(shards):
+    counts = shards.shard_table("sh_orders")
+    expected = [0, 0, 0]
+    for row_id in range(ORDERS):
+        expected[shards._shard_of(row_id, 3)] += 1
+    assert counts == expected
+    assert [part["sh_orders"]["rows"] for part in shards.shard_report()] == expected
+    local = shards.retrieve_data("sh_orders")
+    assert shards.shard_get("sh_orders", 17) == local[17]
+    assert shards.shard_mget("sh_orders", [5, 999, 3]) == {5: local[5], 3: local[3]}
+
+
+def test_find_and_aggregate_match_local(shards):
+    shards.shard_table("sh_orders", key="cust")
+    query = {"amount": {"$gte": 250}}
+    assert shards.shard_find("sh_orders", query)[0] == shards.mongo_find("sh_orders", query)[0]
+    assert shards.shard_find("sh_orders", query, count=True)[0] == shards.mongo_find("sh_orders", query, count=True)[0]
+    top = shards.shard_find("sh_orders", query, sort=[("amount", -1), ("oid", 1)], skip=2, limit=5)[0]
+    assert list(top.items()) == list(shards.mongo_find("sh_orders", query, sort=[("amount", -1), ("oid", 1)],
+                                                       skip=2, limit=5)[0].items())
+    pipeline = [{"$match": {"amount": {"$lt": 400}}},
+                {"$group": {"_id": "$cust", "n": {"$sum": 1}, "total": {"$sum": "$amount"}, "top": {"$max": "$amount"}}},
+                {"$sort": {"_id": 1}}]
+    sharded, plan = shards.shard_aggregate("sh_orders", pipeline)
+    assert "scatter $group" in plan
+    assert sorted(sharded, key=repr) == sorted(shards.mongo_aggregate("sh_orders", pipeline)[0], key=repr)
+
+
+def test_reshard_moves_only_rows_whose_shard_changes(shards):
+    shards.shard_table("sh_orders")
+    for old, n in [(3, 4), (4, 2)]:
+        expected = sum(shards._shard_of(row_id, old) != shards._shard_of(row_id, n) for row_id in range(ORDERS))
+        assert shards.reshard(n) == expected
+        assert len(shards._shards) == n
+        report = [part["sh_orders"]["rows"] for part in shards.shard_report()]
+        assert report == [sum(shards._shard_of(row_id, n) == shard_no for row_id in range(ORDERS))
+                          for shard_no in range(n)]
+    assert shards.shard_find("sh_orders")[0] == shards.retrieve_data("sh_orders")
+
+
+@pytest.mark.parametrize("join_type", ["inner", "left", "anti"])
+def test_shuffle_and_co_located_joins_match_local(shards, join_type):
+    local = _rows(shards.join_stored("sh_orders", "sh_customers", "cust", "cid", join_type)[0])
+    shards.shard_table("sh_orders")
+    shards.shard_table("sh_customers")
+    rows, plan = shards.shard_join("sh_orders", "sh_customers", "cust", "cid", join_type)
+    assert plan.startswith("shuffle join (2 sides shuffled")
+    assert _rows(rows) == local
+    assert set(shards.sharded_tables) == {"sh_orders", "sh_customers"}
+    shards.shard_table("sh_orders", key="cust")
+    shards.shard_table("sh_customers", key="cid")
+    rows, plan = shards.shard_join("sh_orders", "sh_customers", "cust", "cid", join_type)
+    assert plan.startswith("co-located join")
+    assert _rows(rows) == local
+
+
+def test_dead_shard_is_cut_off_and_survivors_carry_on(shards):
+    shards.shard_table("sh_orders")
+    dead = shards._shards[1]["process"]
+    os.kill(dead.pid, signal.SIGKILL)
+    dead.join()
+    with pytest.raises((EOFError, OSError)):
+        shards.shard_report()
+    assert [shard["broken"] for shard in shards._shards] == [True, True, False]
+    before = [shard["broken"] for shard in shards._shards]
+    with pytest.raises(RuntimeError, match="broken"):
+        shards.shard_find("sh_orders", count=True)
+    assert [shard["broken"] for shard in shards._shards] == before
+    assert shards.shard_get("sh_orders", next(i for i in range(ORDERS) if shards._shard_of(i, 3) == 2)) is not None
+    shards.drop_broken_shards()
+    assert len(shards._shards) == 1
+    survivors = {i for i in range(ORDERS) if shards._shard_of(i, 3) == 2}
+    assert set(shards.shard_find("sh_orders")[0]) == survivors
@@ -0,0 +1,69 @@
+import random
+import sqlite3
+
+import pytest
+
+# Small enough that every partition and run below goes through a spill file
+BUDGET = 4096
+
+
+@pytest.fixture(scope="module")
+def spill(inmemory):
+    random.seed(23)
+    left = {i: {"id": i, "k": random.choice([None] + list(range(300))), "a": random.random()} for i in range(1, 3001)}
+    right = {i: {"rid": i, "k": random.choice([None] + list(range(100, 400))), "b": f"b{i}"} for i in range(1, 1001)}
+    inmemory.store_data("sp_l", left)
+    inmemory.store_data("sp_r", right)
+    conn = sqlite3.connect(inmemory.DISK_DB_FILE)
+    yield inmemory, conn
+    conn.close()
+    inmemory.drop_table("sp_l")
+    inmemory.drop_table("sp_r")
+
+
+@pytest.mark.parametrize("build_side", ["left", "right"])
+@pytest.mark.parametrize("join_type", ["inner", "left", "right", "full", "semi", "anti"])
+def test_grace_join_matches_hash_join(spill, join_type, build_side):
+    inmemory, _ = spill
+    left, right = inmemory.retrieve_data("sp_l"), inmemory.retrieve_data("sp_r")
+    expected = dict(inmemory.hash_join(left, right, "k", "k", join_type, build_side))
+    joins = inmemory.spill_stats["joins"]
+    got = inmemory.grace_hash_join(inmemory.stream_table("sp_l"), inmemory.stream_table("sp_r"), "k", "k",
+                                   join_type, build_side, partitions=4, budget=BUDGET)
+    assert dict(got) == expected
+    assert inmemory.spill_stats["joins"] == joins + 1
+
+
+@pytest.mark.parametrize("join_type, sql", [("inner", "JOIN"), ("left", "LEFT JOIN")])
+def test_join_stored_spills_over_budget(spill, monkeypatch, join_type, sql):
+    inmemory, conn = spill
+    monkeypatch.setattr(inmemory, "MEMORY_BUDGET_BYTES", BUDGET)
+    rows, plan = inmemory.join_stored("sp_l", "sp_r", "k", "k", join_type)
+    assert "grace hash join" in plan
+    # Unmatched left rows have no rid, like SQLite's NULL
+    got = sorted((record["id"], record.get("rid")) for _, record in rows)
+    assert got == conn.execute(f"SELECT l.id, r.rid FROM sp_l l {sql} sp_r r ON l.k = r.k ORDER BY 1, 2").fetchall()
+
+
+def test_external_sort_merges_spilled_runs(inmemory, monkeypatch):
+    monkeypatch.setattr(inmemory, "SPILL_MERGE_FANIN", 2)
+    random.seed(3)
+    items = [(random.randint(0, 50), i) for i in range(12000)]
+    runs = inmemory.spill_stats["runs"]
+    for reverse in (False, True):
+        got = list(inmemory.external_sort(iter(items), key=lambda item: item[0], reverse=reverse, budget=BUDGET))
+        # Stable like sorted(): ties keep their input order
+        assert got == sorted(items, key=lambda item: item[0], reverse=reverse)
+    assert inmemory.spill_stats["runs"] > runs + 2 * (12000 // inmemory.SPILL_BATCH_ROWS)
+    assert list(inmemory.external_sort([], budget=BUDGET)) == []
+
+
+def test_sorted_find_spills_and_matches_sqlite(spill, monkeypatch):
+    inmemory, conn = spill
+    monkeypatch.setattr(inmemory, "MEMORY_BUDGET_BYTES", BUDGET)
+    sorts = inmemory.spill_stats["sorts"]
+    found, plan = inmemory.mongo_find("sp_l", {"a": {"$lt": 0.9}}, {"id": 1}, [("k", 1), ("id", -1)])
+    assert plan.endswith("+ sort")
+    assert inmemory.spill_stats["sorts"] > sorts
+    reference = conn.execute("SELECT id FROM sp_l WHERE a < 0.9 ORDER BY k, id DESC").fetchall()
+    assert list(found) == [row_id for (row_id,) in reference]
@@ -0,0 +1,86 @@
+import random
+import sqlite3
+
+import pytest
+
+QUERIES = [
+    "SELECT * FROM emp WHERE dept = 2",
+    "SELECT name, sal FROM emp WHERE age BETWEEN 30 AND 33 AND sal IS NOT NULL",
+    "SELECT COUNT(*), SUM(sal), AVG(sal), MIN(name), MAX(age) FROM emp",
+    "SELECT dept, COUNT(*) AS c, AVG(age) FROM emp GROUP BY dept HAVING c > 100 ORDER BY c DESC",
+    "SELECT dept, MAX(sal) FROM emp WHERE dept NOT IN (1, 2) GROUP BY 1 ORDER BY 2",
+    "SELECT e.name, d.dname FROM emp e JOIN dept d ON e.dept = d.did WHERE d.budget >= 2000 AND e.age < 25",
+    "SELECT e.id FROM emp e, dept d WHERE e.dept = d.did AND d.dname = 'D3' AND e.age = 40",
+    "SELECT COUNT(*) FROM emp e JOIN emp f ON e.age = f.age WHERE e.id < 50",
+    "SELECT e.id, d.dname FROM emp e LEFT JOIN dept d ON e.dept = d.did AND d.did <> 2 WHERE e.age > 68",
+    "SELECT p.*, d.budget FROM proj p LEFT JOIN dept d ON d.did = p.dept WHERE d.budget IS NULL",
+    "SELECT d.dname, p.title FROM dept d RIGHT JOIN proj p ON p.dept = d.did",
+    "SELECT d.dname, p.title FROM dept d FULL OUTER JOIN proj p ON p.dept = d.did",
+    "SELECT p.title, COUNT(DISTINCT e.age) FROM proj p JOIN emp e ON e.dept = p.dept GROUP BY p.title",
+    "SELECT DISTINCT name FROM emp ORDER BY name",
+    "SELECT DISTINCT dept, name FROM emp WHERE age < 30",
+    "SELECT id FROM emp WHERE name LIKE 'b%' OR name IN ('cy', NULL) ORDER BY id DESC LIMIT 5 OFFSET 3",
+    "SELECT id, name FROM emp WHERE name LIKE '_e%' ORDER BY age, id LIMIT 10",
+    "SELECT id, age / 7, age % 7, -age, sal * 2, name || '!' FROM emp WHERE id < 20",
+    "SELECT UPPER(name), LENGTH(name), COALESCE(sal, 0) FROM emp WHERE id <= 10",
+    "SELECT COUNT(*) FROM emp WHERE sal > 'a' OR name < 5",
+    "SELECT name FROM emp WHERE NOT (age > 20) AND dept IS NULL",
+    "SELECT COUNT(*) FROM emp WHERE age >= 60",
+    "SELECT * FROM proj WHERE title = 'zap' AND dept = 5",
+    "SELECT SUM(age) FROM emp WHERE id > 99999",
+]
+
+# Queries the planner should answer from an index rather than a scan
+INDEXED = [
+    "SELECT * FROM emp WHERE dept = 2",
+    "SELECT name, sal FROM emp WHERE age BETWEEN 30 AND 33 AND sal IS NOT NULL",
+    "SELECT COUNT(*) FROM emp WHERE age >= 60",
+]
+
+
+@pytest.fixture(scope="module")
+def sql(inmemory):
+    random.seed(5)
+    emp = {i: {"id": i, "name": random.choice(["ann", "Bob", "cy", "dee", None]),
+               "dept": random.choice([1, 2, 3, 4, None]),
+               "sal": random.choice([None, 1.5, 100, 250, 3000, 42]),
+               "age": random.randint(18, 70)} for i in range(1, 3001)}
+    dept = {i: {"did": i, "dname": f"D{i}", "budget": i * 1000} for i in range(1, 4)}
+    proj = {i: {"pid": i, "dept": random.choice([1, 2, 3, 5]), "title": random.choice(["x", "Yolo", "zap"])}
+            for i in range(1, 40)}
+    inmemory.store_data("emp", emp)
+    inmemory.store_data("dept", dept)
+    inmemory.store_data("proj", proj)
+    inmemory.set_table_layout("proj", "columnar")
+    inmemory.create_index("emp", "dept", "manual")
+    inmemory.create_index("dept", "did", "unique")
+    inmemory.create_index("emp", "age", "ordered")
+    conn = sqlite3.connect(inmemory.DISK_DB_FILE)
+    yield inmemory, conn
+    conn.close()
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_matches_sqlite(sql, query):
+    inmemory, conn = sql
+    _, rows, plan = inmemory.execute_sql(query)
+    reference = conn.execute(query).fetchall()
+    assert inmemory._sql_rows_match(rows, reference), (plan, rows[:5], reference[:5])
+    if "ORDER BY" in query and "LIMIT" in query:
+        assert [tuple(row) for row in rows] == reference
+
+
+@pytest.mark.parametrize("query", INDEXED)
+def test_index_paths(sql, query):
+    inmemory, conn = sql
+    _, rows, plan = inmemory.execute_sql(query)
+    assert "index" in str(plan)
+    assert inmemory._sql_rows_match(rows, conn.execute(query).fetchall())
+
+
+@pytest.mark.parametrize("query", ["SELECT nope FROM emp", "SELECT * FROM nothere", "SELEC x",
+                                   "UPDATE emp SET a = 1", "SELECT SUM(*) FROM emp"])
+def test_rejects_bad_queries(sql, query):
+    inmemory, _ = sql
+    with pytest.raises(ValueError):
+        inmemory.execute_sql(query)